@@ -13,7 +13,13 @@ from tensor_utils import *
 
 class MoBoAligner(nn.Module):
     def __init__(
-        self, text_channels, mel_channels, attention_dim, noise_scale=2.0, max_dur=10
+        self,
+        text_channels,
+        mel_channels,
+        attention_dim,
+        noise_scale=2.0,
+        max_dur=10,
+        compile_recursion=False,  # whether to compile each step of the boundary prob recursion with torch.compile
     ):
         super(MoBoAligner, self).__init__()
         self.mel_layer = LinearNorm(
@@ -34,6 +40,12 @@ class MoBoAligner(nn.Module):
         self.noise_scale = noise_scale
         self.max_dur = max_dur  # max duration of a text token
 
+        self.boundary_prob_step = (
+            torch.compile(boundary_prob_step)
+            if compile_recursion
+            else boundary_prob_step
+        )
+
     def check_parameter_validity(self, text_mask, mel_mask, direction):
         """
         Check if the parameters are valid for the alignment.
@@ -47,11 +59,15 @@ class MoBoAligner(nn.Module):
             raise ValueError(
                 f"Direction must be a subset of 'forward' or 'backward', {direction} is not allowed."
             )
-        if not torch.all(I <= J):
+        # copy both checks to the host at once, which only synchronizes with the device once
+        text_shorter_than_mel, mel_within_max_dur = torch.stack(
+            (torch.all(I <= J), torch.all(I * self.max_dur >= J))
+        ).tolist()
+        if not text_shorter_than_mel:
             raise ValueError(
                 f"The length of text hiddens is greater than the length of mel hiddens, which is not allowed."
             )
-        if not torch.all(I * self.max_dur >= J):
+        if not mel_within_max_dur:
             raise ValueError(
                 f"The length of mel hiddens is greater than or equal to the {self.max_dur} times of the length of text hiddens, which is not allowed. Try to increase the max_dur or use RoMoAligner."
             )
@@ -70,18 +86,24 @@ class MoBoAligner(nn.Module):
         """
         processed_mel = self.mel_layer(mel_hiddens.unsqueeze(1))  # (B, 1, J, D_att)
         processed_text = self.text_layer(text_hiddens.unsqueeze(2))  # (B, I, 1, D_att)
-        energy = self.v(torch.tanh(processed_mel + processed_text))  # (B, I, J, 1)
+        energy = self.v(
+            (processed_mel + processed_text).tanh_()
+        )  # (B, I, J, 1), tanh in place to avoid a second (B, I, J, D_att) tensor
 
         energy = energy.squeeze(-1)  # (B, I, J)
 
-        noise = torch.randn_like(energy) * self.noise_scale
-        # energy = F.sigmoid(energy + noise).log()
-        energy = -F.softplus(-energy - noise)  # log(sigmoid(x)) = -softplus(-x)
+        noise = torch.randn_like(energy)
+        # energy = torch.sigmoid(energy + noise).log()
+        energy = F.logsigmoid(
+            torch.add(energy, noise, alpha=self.noise_scale)
+        )  # scale and add the noise in one kernel, log(sigmoid(x)) in another
         energy.masked_fill_(~alignment_mask, LOG_EPS)
 
         return energy
 
-    def compute_reversed_energy_and_masks(self, energy, text_mask, mel_mask):
+    def compute_reversed_energy_and_masks(
+        self, energy, text_mask, mel_mask, alignment_mask
+    ):
         """
         Compute the backward energy matrix and the corresponding text and mel masks.
 
@@ -89,27 +111,19 @@ class MoBoAligner(nn.Module):
             energy (torch.FloatTensor): The energy matrix of shape (B, I, J).
             text_mask (torch.BoolTensor): The text mask of shape (B, I).
             mel_mask (torch.BoolTensor): The mel hidden mask of shape (B, J).
+            alignment_mask (torch.BoolTensor): The alignment mask of shape (B, I, J).
 
         Returns:
             energy_backward (torch.FloatTensor): The backward energy matrix of shape (B, I-1, J-1).
             text_mask_backward (torch.BoolTensor): The backward text mask of shape (B, I-1).
             mel_mask_backward (torch.BoolTensor): The backward mel hidden mask of shape (B, J-1).
+            alignment_mask_backward (torch.BoolTensor): The backward alignment mask of shape (B, I-1, J-1).
         """
-        shifts_text_dim = compute_max_length_diff(text_mask)
-        shifts_mel_dim = compute_max_length_diff(mel_mask)
-
-        energy_backward = shift_tensor(
-            energy.flip(1, 2).unsqueeze(-1),
-            shifts_text_dim=-shifts_text_dim,
-            shifts_mel_dim=-shifts_mel_dim,
-        ).squeeze(-1)
-
-        energy_backward = energy_backward[:, 1:, 1:]
+        energy_backward = flip_by_lengths(energy, text_mask, mel_mask)[:, 1:, 1:]
         text_mask_backward = text_mask[:, 1:]
         mel_mask_backward = mel_mask[:, 1:]
-        alignment_mask_backward = compute_alignment_mask(
-            text_mask_backward, mel_mask_backward
-        )  # (B, I-1, J-1)
+        # same as compute_alignment_mask(text_mask_backward, mel_mask_backward)
+        alignment_mask_backward = alignment_mask[:, 1:, 1:]  # (B, I-1, J-1)
         return (
             energy_backward,
             text_mask_backward,
@@ -129,22 +143,28 @@ class MoBoAligner(nn.Module):
 
         Returns:
             log_cond_prob (torch.FloatTensor): The log conditional probability tensor of shape (B, I, D, K) for forward, or (B, I-1, D+1, K-1) for backward.
-            log_cond_prob_geq (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I, D, K) for forward, or (B, I-1, D+1, K-1) for backward.
+            log_cond_prob_geq (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I, D, K) for forward, or (B, I-1, D+1, K-1) for backward, reversed on the D dimension.
         """
         B, I = text_mask.shape
         _, K = mel_mask.shape  # K = J, j index from 1 to J, k index from 0 to J-1
 
-        energy_4D = BIJ_to_BIDK(energy, max_dur, padding_direction="right")
+        energy_4D = BIJ_to_BIDK(
+            energy, max_dur, padding_direction="right"
+        )  # a view of energy, not materialized
         valid_mask = gen_left_right_mask(B, I, max_dur, K, text_mask, mel_mask)
-        energy_4D.masked_fill_(~valid_mask, LOG_EPS)
+        energy_4D = torch.where(valid_mask, energy_4D, LOG_EPS)
+
+        # The reversed cumulative logsumexp at d=0 is the logsumexp over the whole D dimension,
+        # so a single scan gives both the normalizer and the cumulative conditional probability.
+        # The cumulative one is kept reversed on the D dimension, because BIDK_transform reverses it anyway.
+        energy_geq = torch.logcumsumexp(energy_4D.flip(2), dim=2)  # reversed on D
+        log_normalizer = energy_geq[:, :, -1:]  # on the D dimension
 
-        log_cond_prob = energy_4D - torch.logsumexp(
-            energy_4D, dim=2, keepdim=True
-        )  # on the D dimension
-        log_cond_prob.masked_fill_(~valid_mask, LOG_EPS)
+        log_cond_prob = energy_4D - log_normalizer
+        log_cond_prob = torch.where(valid_mask, log_cond_prob, LOG_EPS)
 
-        log_cond_prob_geq = torch.logcumsumexp(log_cond_prob.flip(2), dim=2).flip(2)
-        log_cond_prob_geq.masked_fill_(~valid_mask, LOG_EPS)
+        log_cond_prob_geq = energy_geq - log_normalizer
+        log_cond_prob_geq = torch.where(valid_mask.flip(2), log_cond_prob_geq, LOG_EPS)
 
         return log_cond_prob, log_cond_prob_geq
 
@@ -158,22 +178,47 @@ class MoBoAligner(nn.Module):
             mel_mask (torch.BoolTensor): The mel hidden mask of shape (B, J) for forward, or (B, J-1) for backward.
 
         Returns:
-            log_boundary_prob (torch.FloatTensor): The forward tensor of shape (B, I+1, J+1) for forward, or (B, I, J) for backward.
+            log_boundary_prob (torch.FloatTensor): The forward tensor of shape (B, I+1, J+1) for forward, or (B, I, J) for backward, always in float32.
         """
         B, I = text_mask.shape
         _, J = mel_mask.shape
 
-        log_boundary_prob = torch.full(
-            (B, I + 1, J + 1), LOG_EPS, device=log_cond_prob.device, dtype=torch.float
-        )
-        log_boundary_prob[:, 0, 0] = 0  # Initialize forward[0, 0] = 0
+        # Initialize forward[0, 0] = 0. Each row is kept as its own tensor and stacked at the end,
+        # instead of writing into a pre-filled (B, I+1, J+1) tensor in place at every step
+        # The rows are kept in float32 whatever the dtype of log_cond_prob, because the rounding error
+        # of a lower precision would accumulate over the I steps of the recursion
+        log_boundary_prob = [
+            log_one_hot(J + 1, device=log_cond_prob.device, dtype=torch.float).expand(
+                B, -1
+            )
+        ]
+
+        # Transform to j fixed and k from j-D to j-1 once, so that each step of the recursion
+        # is a single add and logsumexp instead of rolling and masking the diagonals again
+        # Put the text dimension first and make it contiguous, so that the slice read by each step
+        # is a contiguous block instead of a strided view over the whole tensor
+        log_cond_prob_trans = (
+            BIDK_transform(log_cond_prob).transpose(0, 1).contiguous()
+        )  # (I, B, D, J)
+        D = log_cond_prob_trans.shape[2]
         for i in range(1, I + 1):
-            log_boundary_prob[:, i, i:] = diag_logsumexp(
-                log_boundary_prob[:, i - 1, :-1].unsqueeze(1)
-                + log_cond_prob[:, i - 1],  # (B, D, J)
-                from_ind=i - 1,
-            )  # sum at the D dimension
-
+            # B_i is at most i*D, the boundaries after it stay at LOG_EPS and need not to be computed
+            J_reachable = min(J, i * D)
+            # sum at the D dimension
+            log_boundary_prob_i = self.boundary_prob_step(
+                log_boundary_prob[i - 1][:, :J_reachable],
+                log_cond_prob_trans[i - 1, :, :, :J_reachable].float(),  # upcast one slice at a time
+            )[:, i - 1 :]
+            log_boundary_prob.append(
+                F.pad(
+                    log_boundary_prob_i,
+                    (i, J - J_reachable),
+                    mode="constant",
+                    value=LOG_EPS,
+                )
+            )  # (B, J+1)
+
+        log_boundary_prob = torch.stack(log_boundary_prob, dim=1)  # (B, I+1, J+1)
         return log_boundary_prob
 
     def compute_interval_prob(
@@ -184,7 +229,7 @@ class MoBoAligner(nn.Module):
 
         Args:
             boundary_prob (torch.FloatTensor): The forward or backward tensor of shape (B, I, J) for forward, or (B, I-1, J-1) for backward.
-            log_cond_prob_geq_or_gt (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I, D, K) for forward, or (B, I-1, D, J-1) for backward.
+            log_cond_prob_geq_or_gt (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I, D, K) for forward, or (B, I-1, D, J-1) for backward, reversed on the D dimension.
             text_mask (torch.BoolTensor): The text mask of shape (B, I) for forward, or (B, I-1) for backward.
             alignment_mask (torch.BoolTensor): The alignment mask of shape (B, I, J) for forward, or (B, I-1, J-1) for backward.
 
@@ -196,9 +241,11 @@ class MoBoAligner(nn.Module):
             boundary_prob, D=D, padding_direction="left"
         )  # -> (B, I, D, K) for forward , or (B, I-1, D-1, K-1) for backward
         log_cond_prob_geq_or_gt_trans = BIDK_transform(
-            log_cond_prob_geq_or_gt
+            log_cond_prob_geq_or_gt, reversed_d=True
         )  # -> (B, I, D, K) for forward, or (B, I-1, D-1, K-1) for backward
 
+        # boundary_prob is float32, so the sum promotes a lower precision log_cond_prob_geq_or_gt and the
+        # log interval prob, the last text prob and the soft alignment after them stay in float32
         log_interval_prob = torch.logsumexp(
             prob_trans[:, :-1] + log_cond_prob_geq_or_gt_trans[:, :-1], dim=2
         )  # (B, I-1, J) for forward, or (B, I-2, J-1) for backward
@@ -220,8 +267,9 @@ class MoBoAligner(nn.Module):
         Returns:
             log_interval_prob (torch.FloatTensor): The combined log probabilities of shape (B, I, J).
         """
-        log_interval_prob = torch.logaddexp(
-            log_interval_forward - LOG_2, log_interval_backward - LOG_2
+        # log((exp(a) + exp(b)) / 2), subtract LOG_2 once after the logaddexp
+        log_interval_prob = (
+            torch.logaddexp(log_interval_forward, log_interval_backward) - LOG_2
         )
         return log_interval_prob
 
@@ -302,7 +350,9 @@ class MoBoAligner(nn.Module):
                 text_mask_backward,
                 mel_mask_backward,
                 alignment_mask_backward,
-            ) = self.compute_reversed_energy_and_masks(energy, text_mask, mel_mask)
+            ) = self.compute_reversed_energy_and_masks(
+                energy, text_mask, mel_mask, alignment_mask
+            )
 
             # 1.2 Compute the log conditional probability P(B_i=j | B_{i+1}=k), P(B_i < j | B_{i+1}=k) for backward
             log_cond_prob_backward, log_cond_prob_geq_backward = self.compute_cond_prob(
@@ -8,14 +8,18 @@ def maximum_path(value, mask):
   value: [b, t_x, t_y]
   mask: [b, t_x, t_y]
   """
-  value = value * mask
   device = value.device
   dtype = value.dtype
-  value = value.data.cpu().numpy().astype(np.float32)
+  # maximum_path_c only visits the valid region, so only the lengths of the mask are copied to the host,
+  # stacked to copy them in one transfer
+  t_x_max, t_y_max = torch.stack((mask.sum(1)[:, 0], mask.sum(2)[:, 0])).int().cpu().numpy()
+  # maximum_path_c writes the accumulated scores into value, so always work on a copy, also for a float32 cpu tensor
+  value = value.detach().to(device="cpu", dtype=torch.float, copy=True).contiguous().numpy()
   path = np.zeros_like(value).astype(np.int32)
-  mask = mask.data.cpu().numpy()
 
-  t_x_max = mask.sum(1)[:, 0].astype(np.int32)
-  t_y_max = mask.sum(2)[:, 0].astype(np.int32)
   maximum_path_c(path, value, t_x_max, t_y_max)
-  return torch.from_numpy(path).to(device=device, dtype=dtype)
+  path = torch.from_numpy(path)
+  if device.type == "cuda":
+    # copy back from page-locked memory without blocking the host
+    path = path.pin_memory().to(device=device, non_blocking=True)
+  return path.to(device=device, dtype=dtype)
@@ -1,10 +1,25 @@
+import sys
+
 from distutils.core import setup
+from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy
 
+# prange only runs in parallel when the extension is compiled and linked with OpenMP,
+# the default Apple clang has no -fopenmp, so macOS keeps the serial build
+openmp_args = ["-fopenmp"] if sys.platform.startswith("linux") else []
+ext_modules = [
+  Extension(
+    "monotonic_align.core",
+    ["core.pyx"],
+    extra_compile_args=openmp_args,
+    extra_link_args=openmp_args,
+  )
+]
+
 setup(
   name = 'monotonic_align',
-  ext_modules = cythonize("core.pyx"),
+  ext_modules = cythonize(ext_modules),
   include_dirs=[numpy.get_include()]
 )
 
@@ -3,6 +3,25 @@ import torch
 import torch.nn.functional as F
 from .robo_utils.core import float_to_int_duration_batch_c, generate_random_intervals_batch_c
 
+def _to_numpy(x):
+    """ Copy a tensor to a numpy array, staging through page-locked memory for CUDA tensors.
+    The pinned buffer comes from PyTorch's caching host allocator, so it is recycled without sharing it between callers.
+    """
+    if x.device.type != "cuda":
+        return x.cpu().numpy()
+    host = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+    host.copy_(x, non_blocking=True)
+    torch.cuda.current_stream(x.device).synchronize()
+    return host.numpy()
+
+def _from_numpy(x, device):
+    """ Copy a numpy array to a tensor on the device, without blocking the host for CUDA devices.
+    """
+    x = torch.from_numpy(x)
+    if device.type == "cuda":
+        x = x.pin_memory().to(device=device, non_blocking=True)
+    return x
+
 def float_to_int_duration(dur, T, mask):  
     """ Cython optimised version of converting float duration to int duration.
     
@@ -13,22 +32,27 @@ def float_to_int_duration(dur, T, mask):
     Returns:
         torch.LongTensor: output int duration, shape (B, I)
     """
-    dur = dur * mask
+    # no need to mask dur, the kernel stops at the first invalid position of each sample
     device = dur.device
-    dur = dur.data.cpu().numpy().astype(np.float32)
-    T = T.data.cpu().numpy().astype(np.int32)
-    mask = mask.data.cpu().numpy().astype(np.int32)
+    I = dur.shape[1]
+    # pack dur, mask and T into one tensor, so that only one device to host copy (and sync) is needed
+    packed = _to_numpy(torch.cat(
+        (dur.data.float(), mask.data.float(), T.data.float().unsqueeze(1)), dim=1
+    ))
+    dur = np.ascontiguousarray(packed[:, :I])
+    mask = packed[:, I:2 * I].astype(np.int32)
+    T = packed[:, 2 * I].astype(np.int32)
 
     int_dur = np.zeros_like(dur).astype(dtype=np.int32)
     float_to_int_duration_batch_c(dur, T, mask, int_dur)
-    return torch.from_numpy(int_dur).to(device=device, dtype=torch.long)
+    return _from_numpy(int_dur, device).to(device=device, dtype=torch.long)
 
 def generate_random_intervals(boundaries_batch, num_randoms):
     boundaries_batch = F.pad(boundaries_batch, (1, 0, 0, 0))
     
     device = boundaries_batch.device
-    boundaries_batch = boundaries_batch.data.cpu().numpy().astype(np.int32)
+    boundaries_batch = _to_numpy(boundaries_batch.data).astype(np.int32)
 
     result_batch = np.zeros((boundaries_batch.shape[0], (boundaries_batch.shape[1] - 1) * (num_randoms + 1)), dtype=np.int32)
     generate_random_intervals_batch_c(boundaries_batch, result_batch, num_randoms)
-    return torch.from_numpy(result_batch).to(device=device, dtype=torch.long)
+    return _from_numpy(result_batch, device).to(device=device, dtype=torch.long)
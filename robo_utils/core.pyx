@@ -112,5 +112,7 @@ cpdef void generate_random_intervals_batch_c(int[:, :] boundaries_batch, int[:,
     """
     cdef int B = boundaries_batch.shape[0]
     cdef int i
-    for i in prange(B, nogil=True):
+    # a plain range instead of prange: rand() is shared libc state, so parallel rows would
+    # make the random values depend on the thread schedule
+    for i in range(B):
         generate_random_intervals_each(boundaries_batch[i], result_batch[i], num_randoms)
\ No newline at end of file
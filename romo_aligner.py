@@ -10,7 +10,12 @@ from espnet.nets.pytorch_backend.conformer.encoder import Encoder as ConformerEn
 from layers import LinearNorm
 from rough_aligner import RoughAligner
 from mobo_aligner import MoBoAligner
-from tensor_utils import get_mat_p_f, get_valid_max, cal_max_hidden_memory_size
+from tensor_utils import (
+    batched_unique,
+    expand_by_durations,
+    get_valid_max,
+    cal_max_hidden_memory_size,
+)
 import robo_utils
 
 class RoMoAligner(nn.Module):
@@ -157,10 +162,7 @@ class RoMoAligner(nn.Module):
         indices = robo_utils.generate_random_intervals(boundary_index, self.num_candidate_boundaries)        
         indices = torch.clamp(indices, min=min_index, max=max_index)
 
-        unique_indices = (torch.unique(i) for i in indices)
-        unique_indices = torch.nn.utils.rnn.pad_sequence(
-            unique_indices, batch_first=True, padding_value=-1
-        )
+        unique_indices = batched_unique(indices, padding_value=-1)
 
         unique_indices_mask = unique_indices != -1
         unique_indices = unique_indices * unique_indices_mask
@@ -228,12 +230,10 @@ class RoMoAligner(nn.Module):
             selected_boundary_indices, (1, 0), mode="constant", value=-1
         ).diff(1)
         repeat_times = repeat_times * selected_boundary_indices_mask
-        mat_d_f = get_mat_p_f(
-            mat_p_d.transpose(1, 2), repeat_times
-        )  # (B, K, I) -> (B, K, J)
 
-        mat_p_f = torch.bmm(mat_p_d, mat_d_f)
-        hard_mat_p_f = torch.bmm(hard_mat_p_d, mat_d_f)
+        # mat_p_d @ mat_d_f, gather the columns instead of materializing mat_d_f of shape (B, K, J)
+        mat_p_f = expand_by_durations(mat_p_d, repeat_times)  # (B, I, K) -> (B, I, J)
+        hard_mat_p_f = expand_by_durations(hard_mat_p_d, repeat_times)
         dur_by_mobo = hard_mat_p_f.sum(2)
 
         return mat_p_f, hard_mat_p_f, dur_by_mobo
@@ -1,3 +1,5 @@
+import math
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -15,6 +17,32 @@ class RoughAligner(nn.Module):
             attention_head, attention_dim, dropout
         )
 
+    def compute_attention_weights(self, query, key, mask):
+        """
+        Compute the attention weights of the cross-attention, same as self.cross_attention.attn after calling self.cross_attention(query, key, key, mask).
+        Only the weights are used, so the value projection, the weighted sum and the output projection are skipped.
+
+        Args:
+            query (torch.Tensor): The query of shape (B, J, H).
+            key (torch.Tensor): The key of shape (B, I, H).
+            mask (torch.Tensor): The key mask of shape (B, 1, I).
+
+        Returns:
+            attn (torch.Tensor): The attention weights of shape (B, head, J, I).
+        """
+        B = query.size(0)
+        h, d_k = self.cross_attention.h, self.cross_attention.d_k
+        # scale q by 1/sqrt(d_k) before the product instead of scaling the larger (B, head, J, I) scores
+        q = self.cross_attention.linear_q(query) * (1 / math.sqrt(d_k))
+        q = q.view(B, -1, h, d_k).transpose(1, 2)  # (B, head, J, d_k)
+        k = self.cross_attention.linear_k(key).view(B, -1, h, d_k).transpose(1, 2)  # (B, head, I, d_k)
+        scores = torch.matmul(q, k.transpose(-2, -1))  # (B, head, J, I)
+
+        mask = ~mask.unsqueeze(1)  # (B, 1, 1, I), True means invalid
+        scores = scores.masked_fill(mask, torch.finfo(scores.dtype).min)
+        attn = torch.softmax(scores, dim=-1).masked_fill(mask, 0.0)
+        return attn
+
     def forward(self, text_embeddings, mel_embeddings, text_mask, mel_mask):
         """
         Compute the normalized durations of each text token based on the cross-attention of the text and mel embeddings.
@@ -30,13 +58,11 @@ class RoughAligner(nn.Module):
             int_dur (torch.Tensor): The integer durations of each text token, with shape (B, I), which the sum of each row is equal to the corresponding mel length.
         """
 
-        self.cross_attention(
-            mel_embeddings, text_embeddings, text_embeddings, text_mask.unsqueeze(1)
+        attn = self.compute_attention_weights(
+            mel_embeddings, text_embeddings, text_mask.unsqueeze(1)
         )
-        attn = self.cross_attention.attn
-        x = attn.sum(2).transpose(1, 2) # (B, I, head)
-        x = x.mean(-1) # (B, I)
-        float_dur = F.relu(x) * text_mask
+        x = attn.sum(dim=(1, 2)) / attn.size(1) # sum over mel and mean over heads, (B, head, J, I) -> (B, I)
+        float_dur = torch.where(text_mask, F.relu(x), 0.0)
 
         T = mel_mask.sum(dim=1)
         int_dur = robo_utils.float_to_int_duration(float_dur, T, text_mask)
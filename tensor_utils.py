@@ -21,69 +21,36 @@ def compute_alignment_mask(text_mask, mel_mask):
     Returns:
         alignment_mask (torch.BoolTensor): The alignment mask of shape (B, I, J) for forward or (B, I-1, J-1) for backward.
     """
-    return text_mask.unsqueeze(-1) * mel_mask.unsqueeze(1)  # (B, I, J)
+    return text_mask.unsqueeze(-1) & mel_mask.unsqueeze(1)  # (B, I, J)
 
 
-def roll_tensor(tensor, shifts, dim):
+def flip_by_lengths(x, text_mask, mel_mask):
     """
-    Right shift the multi-dimensional tensor (2D or 3D or 4D...) along the given dimension.
+    Reverse the valid part of each sample along the text and mel hiddens in a single gather.
+    Same as flipping x along the text and mel hiddens and then rolling each sample left by its padding lengths.
 
     Args:
-        tensor (torch.Tensor): The input tensor of shape (B, I) or (B, I, J) or (B, I, J, K) or ....
-        shifts (torch.Tensor): The shift amounts along the dimension of shape (B,)
-        dim (int): The dimension to roll.
-
-    Returns:
-        result (torch.Tensor): The rolled tensor of shape (B, I) or (B, I, J) or (B, I, J, K) or ....
-    """
-
-    # Get the shape of the tensor
-    shape = tensor.size()
-
-    # Ensure that dim is within the valid range
-    assert dim >= 0 and dim < len(shape), "Invalid hidden"
-
-    # Generate an index tensor
-    indices = (
-        torch.arange(shape[dim], device=tensor.device)
-        .view([1] * dim + [-1] + [1] * (len(shape) - dim - 1))
-        .expand(shape)
-    )
-
-    # Reshape shifts
-    shifts = shifts.view([-1] + [1] * (len(shape) - 1))
-
-    # Calculate the shifted indices
-    shifted_indices = (indices - shifts) % shape[dim]
-
-    # Use the shifted indices to index the tensor
-    result = tensor.gather(dim, shifted_indices.expand(shape))
-
-    return result
-
-
-def shift_tensor(x, shifts_text_dim, shifts_mel_dim):
-    """
-    Shift the tensor x to the right along the text and mel hiddens.
-
-    Args:
-        x (torch.Tensor): The input tensor of shape (B, I, J, K).
-        shifts_text_dim (torch.Tensor): The shift amounts along the text hidden of shape (B,).
-        shifts_mel_dim (torch.Tensor): The shift amounts along the mel hidden of shape (B,).
+        x (torch.Tensor): The input tensor of shape (B, I, J).
+        text_mask (torch.BoolTensor): The text mask of shape (B, I).
+        mel_mask (torch.BoolTensor): The mel mask of shape (B, J).
 
     Returns:
-        x (torch.Tensor): The right-shifted tensor of shape (B, I, J, K).
+        x (torch.Tensor): The reversed tensor of shape (B, I, J), x[b, i, j] = x[b, I_b-1-i, J_b-1-j].
     """
-    x = roll_tensor(x, shifts=shifts_text_dim, dim=1)
-    x = roll_tensor(x, shifts=shifts_mel_dim, dim=2)
-    return x
+    B, I, J = x.shape
+    i_lens = text_mask.sum(1)
+    j_lens = mel_mask.sum(1)
+    indices_b = torch.arange(B, device=x.device)[:, None, None]
+    indices_i = (i_lens[:, None] - 1 - torch.arange(I, device=x.device)) % I  # (B, I)
+    indices_j = (j_lens[:, None] - 1 - torch.arange(J, device=x.device)) % J  # (B, J)
+    return x[indices_b, indices_i[:, :, None], indices_j[:, None, :]]
 
 
-def log_one_hot(I, device):
+def log_one_hot(I, device, dtype=torch.float):
     """
     Generate a log one-hot vector of shape (I,) on the device.
     """
-    x = torch.full((I,), LOG_EPS, device=device)
+    x = torch.full((I,), LOG_EPS, device=device, dtype=dtype)
     x[0] = 0
     return x
 
@@ -105,49 +72,43 @@ def pad_and_reverse_alignment(log_interval_backward, text_mask_backward, mel_mas
         log_interval_backward, (0, 0, 1, 0, 0, 0), "constant", LOG_EPS
     )  # (B, I, J-1)
 
-    onehot = log_one_hot(I_minus_1 + 1, device=log_interval_backward.device)[
-        None, :, None
-    ].repeat(B, 1, 1)
+    onehot = log_one_hot(
+        I_minus_1 + 1,
+        device=log_interval_backward.device,
+        dtype=log_interval_backward.dtype,
+    )
+    onehot = onehot[None, :, None].expand(B, -1, -1)  # (B, I, 1), a view, torch.cat makes the only copy
     log_interval_backward = torch.cat(
         (onehot, log_interval_backward), dim=2
     )  # (B, I, J)
 
-    shifts_text_dim = compute_max_length_diff(text_mask_backward)
-    shifts_mel_dim = compute_max_length_diff(mel_mask_backward)
-    log_interval_backward = shift_tensor(
-        log_interval_backward.flip(1, 2),
-        shifts_text_dim=-shifts_text_dim,
-        shifts_mel_dim=-shifts_mel_dim,
-    )
+    # the padded head token and frame are valid, so the forward masks are the backward ones padded with True
+    text_mask = F.pad(text_mask_backward, (1, 0), mode="constant", value=True)
+    mel_mask = F.pad(mel_mask_backward, (1, 0), mode="constant", value=True)
+    log_interval_backward = flip_by_lengths(log_interval_backward, text_mask, mel_mask)
     return log_interval_backward
 
 
-def compute_max_length_diff(mask):
-    # returned value is always >= 0
-    lengths = mask.sum(1)
-    return lengths.max() - lengths
-
-
-def arange_for_left(lens: torch.LongTensor) -> torch.LongTensor:
+def arange_for_left(lens: torch.LongTensor, I: int = None) -> torch.LongTensor:
     """
     gen arange from 0.
 
     Args:
         lens (torch.LongTensor): The length tensor of shape (B,).
+        I (int): The max length, lens.max() if not given, which needs a device to host copy.
 
     Returns:
         x (torch.LongTensor): The arange tensor of shape (B, I).
     """
-    B = len(lens)
-    I = lens.max()
-    x = torch.arange(I, device=lens.device).unsqueeze(0).repeat(B, 1)
-    mask = x >= lens.unsqueeze(1)
-    x.masked_fill_(mask, 0)
+    if I is None:
+        I = lens.max()
+    x = torch.arange(I, device=lens.device).unsqueeze(0)  # broadcast to (B, I) below
+    x = x.masked_fill(x >= lens.unsqueeze(1), 0)
     return x
 
 
 def arange_for_right(
-    i_lens: torch.LongTensor, j_lens: torch.LongTensor
+    i_lens: torch.LongTensor, j_lens: torch.LongTensor, I: int = None
 ) -> torch.LongTensor:
     """
     gen arange from j_lens - i_lens.
@@ -155,18 +116,17 @@ def arange_for_right(
     Args:
         i_lens (torch.LongTensor): The text length tensor of shape (B,).
         j_lens (torch.LongTensor): The mel length tensor of shape (B,).
+        I (int): The max text length, i_lens.max() if not given, which needs a device to host copy.
 
     Returns:
         x (torch.LongTensor): The arange tensor of shape (B, I).
     """
-    B = len(i_lens)
-    I = i_lens.max()
+    if I is None:
+        I = i_lens.max()
     strat = j_lens - i_lens
-    x = torch.arange(I, device=i_lens.device).unsqueeze(0).repeat(
-        B, 1
-    ) + strat.unsqueeze(1)
-    mask = x >= j_lens.unsqueeze(1)
-    x.masked_fill_(mask, 0)
+    x = torch.arange(I, device=i_lens.device).unsqueeze(0)
+    x = x + strat.unsqueeze(1)  # (B, I) by broadcasting
+    x.masked_fill_(x >= j_lens.unsqueeze(1), 0)
     return x
 
 
@@ -200,17 +160,20 @@ def gen_left_right_mask(
     i_lens = text_mask.sum(1).long()
     j_lens = mel_mask.sum(1).long()
 
-    indices_d = torch.arange(D, device=i_lens.device)[:, None]
-    indices_j = torch.arange(J, device=i_lens.device)[None, :]
-    indices = (indices_d + indices_j).unsqueeze(0).unsqueeze(0).repeat(B, I, 1, 1)
-
-    mask_b = (
-        indices > (arange_for_left(i_lens) - 1)[:, :, None, None]
-    )  # True means valid, False means invalid.
-    mask_e = (
-        indices <= arange_for_right(i_lens, j_lens)[:, :, None, None]
-    )  # True means valid, False means invalid.
-    mask = (mask_b & mask_e) * text_mask.unsqueeze(-1).unsqueeze(-1)
+    # The mask only depends on the mel index d + j, so build it on (B, I, J) and unfold it
+    # like BIJ_to_BIDK, which gives a (B, I, D, J) view without materializing it.
+    # Fold the text mask into the (B, I) bounds, an empty range [0, -1] for the padded text tokens,
+    # so that the (B, I, J) mask is built in a single pass of two comparisons.
+    left = arange_for_left(i_lens, I)
+    right = arange_for_right(i_lens, j_lens, I).masked_fill(~text_mask, -1)
+    indices = torch.arange(J, device=i_lens.device)[None, None, :]
+    mask = (indices >= left[:, :, None]) & (
+        indices <= right[:, :, None]
+    )  # (B, I, J), True means valid, False means invalid.
+
+    mask = F.pad(mask, (0, D - 1, 0, 0, 0, 0), mode="constant", value=False)
+    mask = mask.unfold(dimension=2, size=D, step=1)  # (B, I, J+D-1) -> (B, I, J, D)
+    mask = mask.permute(0, 1, 3, 2)  # (B, I, J, D) -> (B, I, D, J)
     return mask
 
 
@@ -219,12 +182,12 @@ def convert_geq_to_gt(log_cond_prob_geq_backward):
     "greater than or equal to" format to "greater than" format
 
     Args:
-        log_cond_prob_geq_backward (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I-1, D+1, J-1).
+        log_cond_prob_geq_backward (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I-1, D+1, J-1), reversed on the D dimension.
 
     Returns:
-        log_cond_prob_geq_backward (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I-1, D, J-1).
+        log_cond_prob_geq_backward (torch.FloatTensor): The log cumulative conditional probability tensor of shape (B, I-1, D, J-1), reversed on the D dimension.
     """
-    return log_cond_prob_geq_backward[:, :, 1:]
+    return log_cond_prob_geq_backward[:, :, :-1]
 
 
 def get_valid_max(tensor, mask, inf_value=1e6):
@@ -240,10 +203,11 @@ def get_valid_max(tensor, mask, inf_value=1e6):
         min_values (torch.FloatTensor): The minimum value of the valid elements in each sample, shape (B, 1)
         max_values (torch.FloatTensor): The maximum value of the valid elements in each sample, shape (B, 1)
     """
-    masked_tensor = tensor.masked_fill(~mask, inf_value)
+    invalid_mask = ~mask  # negate once for both reductions
+    masked_tensor = tensor.masked_fill(invalid_mask, inf_value)
     min_values, _ = torch.min(masked_tensor, dim=1)
 
-    masked_tensor = tensor.masked_fill(~mask, -inf_value)
+    masked_tensor = tensor.masked_fill(invalid_mask, -inf_value)
     max_values, _ = torch.max(masked_tensor, dim=1)
 
     min_values = min_values.unsqueeze(1)
@@ -258,8 +222,8 @@ def lengths_to_padding_mask(
     bsz = lens.size(0)
     if max_lens is None:
         max_lens = torch.max(lens).item()
-    mask = torch.arange(max_lens).to(lens.device).view(1, max_lens)
-    mask = mask.expand(bsz, -1) >= lens.view(bsz, 1).expand(-1, max_lens)
+    mask = torch.arange(max_lens, device=lens.device).view(1, max_lens)
+    mask = mask >= lens.view(bsz, 1)  # (B, max_lens) by broadcasting
     return mask
 
 
@@ -292,6 +256,53 @@ def get_mat_p_f(src_tokens, durations):
     return mat_p_f
 
 
+def expand_by_durations(x, durations):
+    """
+    Repeat each column of x along the last dimension by the given durations.
+    Same as torch.bmm(x, get_mat_p_f(x.transpose(1, 2), durations)), but gathers the columns instead of materializing the mapping matrix.
+
+    Args:
+        x (torch.FloatTensor): The input tensor of shape (B, I, K).
+        durations (torch.LongTensor): The duration tensor of shape (B, K).
+
+    Returns:
+        y (torch.FloatTensor): The expanded tensor of shape (B, I, T), T is the max sum of durations.
+    """
+    B, I, K = x.shape
+    cumsum_dur = torch.cumsum(durations, dim=-1)  # [B, K]
+    T = cumsum_dur[:, -1].max()
+    indices_t = torch.arange(T, device=x.device).unsqueeze(0).expand(B, -1)  # [B, T]
+    # the k index which the t index belongs to
+    indices_k = torch.searchsorted(cumsum_dur, indices_t.contiguous(), right=True)
+    valid_mask = indices_k < K  # [B, T]
+    y = x.gather(2, indices_k.clamp(max=K - 1).unsqueeze(1).expand(-1, I, -1))
+    y = y * valid_mask.unsqueeze(1)
+    return y
+
+
+def batched_unique(x, padding_value=-1):
+    """
+    Same as pad_sequence([torch.unique(row) for row in x], batch_first=True, padding_value=padding_value), without the loop over the batch.
+
+    Args:
+        x (torch.LongTensor): The input tensor of shape (B, N).
+        padding_value (int): The value to pad the rows with fewer unique values.
+
+    Returns:
+        y (torch.LongTensor): The sorted unique values of each row of shape (B, K), K is the max number of unique values in a row.
+    """
+    B, N = x.shape
+    # sort each row, keep the first of each run of equal values and scatter the kept values to the front of the row
+    x, _ = torch.sort(x, dim=1)
+    keep = F.pad(x.diff(1) != 0, (1, 0), mode="constant", value=True)
+    positions = keep.cumsum(1) - 1
+    K = positions[:, -1].max() + 1
+    y = x.new_full((B, N + 1), padding_value)
+    # the repeated values are sent to the extra column, which is dropped
+    y.scatter_(1, positions.masked_fill(~keep, N), x)
+    return y[:, :K]
+
+
 def calculate_tensor_memory_size(shape, dtype):
     """
     Calculate the memory size of a tensor in MB.
@@ -324,32 +335,22 @@ def cal_max_hidden_memory_size(selected_boundary_indices, D, text_mask):
     )
 
 
-def diag_logsumexp(x, from_ind):
+def boundary_prob_step(prev_log_boundary_prob, log_cond_prob_trans):
     """
-    Calculate the logsumexp of the diagonals of a 3D tensor, from the diagonal with index from_ind to the main diagonal.
+    One step of the boundary prob recursion in the log domain.
 
     Args:
-        x (torch.FloatTensor): The input tensor of shape (B, I, J).
-        from_ind (int): The index of the diagonal to start from.
+        prev_log_boundary_prob (torch.FloatTensor): The log boundary prob of the previous text token of shape (B, J), indexed by k.
+        log_cond_prob_trans (torch.FloatTensor): The log conditional probability of the current text token of shape (B, D, J), with j fixed and k from j-D to j-1.
 
     Returns:
-        x (torch.FloatTensor): The logsumexp of the diagonals of the input tensor of shape (B, J).
-    """
-    B, I, J = x.size()
-    assert from_ind < J, "from_ind should be less than J"
-    x = x.permute(1, 0, 2)  # (I, B, J)
-    x = roll_tensor(x, shifts=torch.arange(I, device=x.device), dim=2)  # (I, B, J)
-
-    mask = (
-        torch.tril(torch.ones((I, J), device=x.device), diagonal=-1)
-        .unsqueeze(1)
-        .repeat(1, B, 1)
-        .bool()
-    )
-    x.masked_fill_(mask, LOG_EPS)
-    x = x.permute(1, 0, 2)  # (B, I, J)
-    x = x[:, :, from_ind:].logsumexp(1)
-    return x
+        log_boundary_prob (torch.FloatTensor): The log boundary prob of the current text token of shape (B, J), indexed by j.
+    """
+    D = log_cond_prob_trans.shape[1]
+    prob_trans = BIJ_to_BIDK(
+        prev_log_boundary_prob.unsqueeze(1), D=D, padding_direction="left"
+    ).squeeze(1)  # (B, D, J)
+    return torch.logsumexp(prob_trans + log_cond_prob_trans, dim=1)
 
 
 def BIJ_to_BIK(Bij):
@@ -393,30 +394,26 @@ def BIJ_to_BIDK(x, D, padding_direction="left"):
     return y
 
 
-def BIDK_transform(x):
+def BIDK_transform(x, reversed_d=False):
     """
     Transform BIDK format with k fixed and j from k+1 to K+D to BIDK format with j fixed and k from j-D to j-1.
 
     Args:
         x (torch.FloatTensor): The input tensor of shape (B, I, D, K).
+        reversed_d (bool): Whether the D dimension of x is already reversed, which saves the flip.
 
     Returns:
         y (torch.FloatTensor): The transformed tensor of shape (B, I, D, K).
     """
-    _, _, D, K = x.size()
-    # view x[0, :, :, 0], x[0, :, :, 1], x[0, :, :, 2] ...
-    x = x.permute(2, 3, 0, 1)  # (D, K, B, I)
-    x = roll_tensor(x, shifts=torch.arange(D, device=x.device), dim=1)  # (D, K, B, I)
-    x = torch.rot90(x, dims=(1, 0))  # (K, D, B, I)
-    x = x.permute(2, 3, 1, 0)  # (B, I, D, K)
-    mask = (
-        torch.triu(torch.ones((D, K), device=x.device), diagonal=K - D + 1)
-        .flip(1)
-        .unsqueeze(0)
-        .unsqueeze(0)
-        .bool()
-    )
-    x.masked_fill_(mask, LOG_EPS)
+    B, I, D, K = x.size()
+    # y[:, :, d, j] = x[:, :, D-1-d, j-(D-1-d)], i.e. reverse the D dimension and shift each row right by D-1-d.
+    # Pad the reversed rows on the left and read them with a stride of W+1, which skews the rows
+    # without rolling, rotating or masking; the padding is exactly the invalid k < 0 part.
+    if not reversed_d:
+        x = x.flip(2)
+    x = F.pad(x, (D - 1, 0, 0, 0, 0, 0, 0, 0), mode="constant", value=LOG_EPS)
+    W = K + D - 1
+    x = x.as_strided((B, I, D, K), (I * D * W, D * W, W + 1, 1))  # (B, I, D, K)
     # view x[0, :, :, 0], x[0, :, :, 1], x[0, :, :, 2] ...
     return x
 
@@ -435,103 +432,50 @@ def force_assign_last_text_prob(log_interval_prob, prob, text_mask, alignment_ma
     Returns:
         log_interval_prob (torch.FloatTensor): The log interval probability tensor of shape (B, I, J).
     """
-    B, _, K = log_interval_prob.shape
+    B, I = text_mask.shape
 
-    log_interval_prob = log_interval_prob.masked_fill(~alignment_mask[:, 1:], 0)
-    log_interval_prob = torch.cat(
-        (log_interval_prob, torch.zeros(B, 1, K, device=prob.device)), dim=1
+    log_interval_prob = F.pad(
+        log_interval_prob, (0, 0, 0, 1, 0, 0)
     )  # (B, I-1, J) -> (B, I, J)
 
     i_lens = text_mask.sum(1)
-    last = prob[torch.arange(B), i_lens - 1].logcumsumexp(1)  # (B, K)
-    log_interval_prob[torch.arange(B), i_lens - 1] += last
-
-    log_interval_prob = log_interval_prob.masked_fill(~alignment_mask, LOG_EPS)
+    last = prob[torch.arange(B, device=prob.device), i_lens - 1].logcumsumexp(1)  # (B, K)
+    is_last = (
+        torch.arange(I, device=text_mask.device)[None, :] == (i_lens - 1)[:, None]
+    )  # (B, I)
+
+    # assign the last text and mask the invalid positions in the same pass
+    log_interval_prob = torch.where(
+        is_last.unsqueeze(-1), last.unsqueeze(1), log_interval_prob
+    )
+    log_interval_prob = torch.where(alignment_mask, log_interval_prob, LOG_EPS)
     return log_interval_prob
 
 
 if __name__ == "__main__":
-    # Example usage 1 (4D tensor)
-    tensor1 = torch.tensor(
-        [
-            [[[1, 2, 3], [4, 5, 6]], [[7, 8, 9], [10, 11, 12]]],
-            [[[13, 14, 15], [16, 17, 18]], [[19, 20, 21], [22, 23, 24]]],
-        ]
-    )  # shape is (2, 2, 2, 3)
-    shifts1 = torch.tensor(
-        [1, 2]
-    )  # Right shift amount for each sample in the last dimension
-    dim1 = 3  # Perform the shift on the last dimension
-    result1 = roll_tensor(tensor1, shifts1, dim1)
-    print("Example 1 - Shift on the last dimension:")
-    print(result1)
-
-    # Example usage 2 (3D tensor)
-    tensor2 = torch.tensor(
-        [
-            [[1, 2], [3, 4], [5, 6]],
-            [[7, 8], [9, 10], [11, 12]],
-            [[13, 14], [15, 16], [17, 18]],
-        ]
-    )  # shape is (3, 3, 2)
-    shifts2 = torch.tensor(
-        [1, 2, 3]
-    )  # Left shift amount for each sample in the second dimension
-    dim2 = 1  # Perform the shift on the second dimension
-    result2 = roll_tensor(tensor2, shifts2, dim2)
-    print("Example 2 - Shift on the second dimension:")
-    print(result2)
-
-    # Example usage 3 (2D tensor)
-    tensor3 = torch.tensor(
-        [
-            [1, 2, 3],
-            [4, 5, 6],
-            [7, 8, 9],
-        ]
-    )  # shape is (3, 3)
-    shifts3 = torch.tensor([1, 2, 3])
-    dim3 = 1
-    result3 = roll_tensor(tensor3, shifts3, dim3)
-    print("Example 3 - Shift on the first dimension:")
-    print(result3)
-
-    # Test case 4
+    # Test case 1
     B, I, D, J = 2, 5, 10, 16
     text_mask = torch.ones(2, 5, dtype=torch.bool)
     text_mask[1, 2:] = 0
     mel_mask = torch.ones(2, 16, dtype=torch.bool)
     mel_mask[1, 5:] = 0
-    print("Example 4 - gen_left_right_mask")
+    print("Example 1 - gen_left_right_mask")
     masked_tensor = gen_left_right_mask(B, I, D, J, text_mask, mel_mask).int()
     print(masked_tensor)
 
-    # Test case 5
+    # Test case 2
     i_lens = text_mask.sum(1).long()
     j_lens = mel_mask.sum(1).long()
-    print("Example 5.1 - arange_for_left")
+    print("Example 2.1 - arange_for_left")
     print(arange_for_left(i_lens))
-    print("Example 5.2 - arange_for_right")
+    print("Example 2.2 - arange_for_right")
     print(arange_for_right(i_lens, j_lens))
 
-    # Test case 6
-    tensor = torch.tensor(
-        [
-            [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]],
-            [[13, 14, 15, 16], [17, 18, 19, 20], [21, 22, 23, 24]],
-        ]
-    )
-
-    # Call the function to compute the logsumexp along the off-diagonal and get the result tensor
-    result = diag_logsumexp(tensor.float(), from_ind=0)
-    print("Example 6 - diag_logsumexp")
-    print(result)
-
     x = torch.tensor(range(1400)).reshape(2, 5, 10, 14).float()  # K=14, D=10
     print(x)
-    print("Example 7 - BIDK_transform")
+    print("Example 3 - BIDK_transform")
     print(BIDK_transform(x))
 
     x = torch.arange(180).view(2, 3, 30).float()
-    print("Example 8 - BIJ_to_BIDK")
+    print("Example 4 - BIJ_to_BIDK")
     print(BIJ_to_BIDK(x, D=10))
@@ -0,0 +1,22 @@
+import monotonic_align
+import torch
+
+def test_maximum_path_keeps_input():
+    torch.manual_seed(0)
+    value = torch.randn(2, 3, 8)
+    mask = torch.ones(2, 3, 8, dtype=torch.bool)
+    mask[1, 2:] = False
+    mask[1, :, 5:] = False
+    value_copy = value.clone()
+
+    path = monotonic_align.maximum_path(value, mask)
+
+    # maximum_path_c accumulates the scores in place, which must not leak into the caller's tensor
+    assert torch.equal(value, value_copy)
+    # each valid mel frame is assigned to exactly one text token
+    assert torch.equal(path.sum(1), mask[:, 0].float())
+
+    print("All tests passed!")
+
+if __name__ == "__main__":
+    test_maximum_path_keeps_input()
@@ -26,6 +26,12 @@ def test_float_to_int_duration_batch():
     expected_output = np.array([[1, 1, 0, 0, 0],
                                 [1, 1, 1, 0, 0]])
     assert np.array_equal(int_dur.data.cpu().numpy(), expected_output)
+
+    # Case 3: the padded durations are garbage, they must not be read
+    dur = torch.FloatTensor([[0.1, 19.2, 7.0, -3.0, 1e6],
+                             [0.2, 0.3, 0.4, float("nan"), 5.5]])
+    int_dur = robo_utils.float_to_int_duration(dur, T, mask)
+    assert np.array_equal(int_dur.data.cpu().numpy(), expected_output)
     
     print("All tests passed!")
 
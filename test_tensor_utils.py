@@ -0,0 +1,100 @@
+import torch
+
+from tensor_utils import (
+    LOG_EPS,
+    BIDK_transform,
+    batched_unique,
+    expand_by_durations,
+    flip_by_lengths,
+    get_mat_p_f,
+)
+
+def test_expand_by_durations():
+    torch.manual_seed(0)
+    # zero durations in the middle, and a padded sample with zero durations at the end
+    durations = torch.LongTensor([[2, 0, 3, 1, 0],
+                                  [1, 2, 0, 0, 0]])
+    x = torch.randn(2, 4, 5)
+
+    y = expand_by_durations(x, durations)
+
+    expected_output = torch.bmm(x, get_mat_p_f(x.transpose(1, 2), durations))
+    assert y.shape == (2, 4, 6)
+    assert torch.equal(y, expected_output)
+    # the frames after the end of the padded sample are zeros
+    assert torch.all(y[1, :, 3:] == 0)
+
+    for _ in range(20):
+        durations = torch.randint(0, 4, (3, 7))
+        durations[0, 0] = 1  # at least one frame
+        x = torch.randn(3, 4, 7)
+        expected_output = torch.bmm(x, get_mat_p_f(x.transpose(1, 2), durations))
+        assert torch.equal(expand_by_durations(x, durations), expected_output)
+
+    print("All tests passed!")
+
+def test_flip_by_lengths():
+    torch.manual_seed(0)
+    x = torch.randn(3, 4, 6)
+    # a full sample, a padded sample and a sample of length 1
+    text_mask = torch.BoolTensor([[1, 1, 1, 1],
+                                  [1, 1, 0, 0],
+                                  [1, 0, 0, 0]])
+    mel_mask = torch.BoolTensor([[1, 1, 1, 1, 1, 1],
+                                 [1, 1, 1, 0, 0, 0],
+                                 [1, 1, 0, 0, 0, 0]])
+
+    y = flip_by_lengths(x, text_mask, mel_mask)
+
+    I, J = text_mask.shape[1], mel_mask.shape[1]
+    for b, (i_len, j_len) in enumerate(zip(text_mask.sum(1).tolist(), mel_mask.sum(1).tolist())):
+        # the valid part is reversed along both dimensions
+        assert torch.equal(y[b, :i_len, :j_len], x[b, :i_len, :j_len].flip(0, 1))
+        # same as flipping the whole sample and rolling the padding back to the end
+        expected_output = torch.roll(x[b].flip(0, 1), shifts=(i_len - I, j_len - J), dims=(0, 1))
+        assert torch.equal(y[b], expected_output)
+
+    print("All tests passed!")
+
+def test_batched_unique():
+    # the second sample is padded, its clamped indices repeat the last boundary
+    x = torch.LongTensor([[3, 1, 3, 7, 5, 5, 9, 7],
+                          [2, 0, 2, 4, 4, 4, 4, 4]])
+    y = batched_unique(x, padding_value=-1)
+
+    expected_output = torch.LongTensor([[1, 3, 5, 7, 9],
+                                        [0, 2, 4, -1, -1]])
+    assert torch.equal(y, expected_output)
+
+    torch.manual_seed(0)
+    for _ in range(20):
+        x = torch.randint(0, 10, (4, 12))
+        expected_output = torch.nn.utils.rnn.pad_sequence(
+            [torch.unique(row) for row in x], batch_first=True, padding_value=-1
+        )
+        assert torch.equal(batched_unique(x, padding_value=-1), expected_output)
+
+    print("All tests passed!")
+
+def test_BIDK_transform():
+    torch.manual_seed(0)
+    # D < K and D > K
+    for B, I, D, K in [(2, 3, 4, 7), (2, 3, 6, 4)]:
+        x = torch.randn(B, I, D, K)
+        # y[:, :, d, j] = x[:, :, D-1-d, j-(D-1-d)], and LOG_EPS where j-(D-1-d) < 0
+        expected_output = torch.full((B, I, D, K), float(LOG_EPS))
+        for d in range(D):
+            shift = D - 1 - d
+            if shift < K:  # rows shifted by K or more are all LOG_EPS
+                expected_output[:, :, d, shift:] = x[:, :, D - 1 - d, : K - shift]
+
+        assert torch.equal(BIDK_transform(x), expected_output)
+        assert torch.equal(BIDK_transform(x.flip(2), reversed_d=True), expected_output)
+
+    print("All tests passed!")
+
+if __name__ == "__main__":
+    test_expand_by_durations()
+    test_flip_by_lengths()
+    test_batched_unique()
+    test_BIDK_transform()